@@ -1,5 +1,4 @@
 from slog import slog
-import paho.mqtt.client as mqtt
 
 
 class MQTT:
@@ -21,19 +20,48 @@ class MQTT:
         return 'MQTT('+self.__log+')'
     
     def connect_mqtt(self):
+        # paho is imported on first connect to keep startup of the proxy fast
+        import paho.mqtt.client as mqtt
+        self.__paho = mqtt
         self.mqtt = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION1, client_id='enverproxy')
+        self.mqtt.on_connect      = self.on_connect
+        self.mqtt.on_disconnect   = self.on_disconnect
+        self.mqtt.on_connect_fail = self.on_connect_fail
         if (self.__user != None or self.__password != None):
             self.mqtt.username_pw_set(self.__user, self.__password)
-        self.mqtt.connect(self.__host, self.__port)
+        # Connect in the background of the mqtt loop, so the proxy does not wait for the broker
+        self.mqtt.connect_async(self.__host, self.__port)
         self.__log.logMsg('Starting mqtt loop', 5)
         self.mqtt.loop_start()
         self.__log.logMsg('mqtt loop started', 5)
 
+    def on_connect(self, client, userdata, flags, rc):
+        # Called by the mqtt loop with the result of the broker to a connect
+        if rc == 0:
+            self.__log.logMsg('Connected to MQTT server ' + str(self.__host) + ':' + str(self.__port), 2)
+        else:
+            self.__log.logMsg('Connection to MQTT server refused: ' + self.__paho.connack_string(rc), 2)
+
+    def on_connect_fail(self, client, userdata):
+        # Called by the mqtt loop when the broker cannot be reached
+        self.__log.logMsg('Could not connect to MQTT server ' + str(self.__host) + ':' + str(self.__port) + ', retrying', 2)
+
+    def on_disconnect(self, client, userdata, rc):
+        # Called by the mqtt loop when the connection to the broker is closed, rc is 0 if requested
+        if rc != 0:
+            self.__log.logMsg('Disconnected from MQTT server, reconnecting: ' + self.__paho.error_string(rc), 2)
+
     def send_command(self, topic, data):
         # topic is the MQTT topic
         # data: dictionary with the data to send
+        # Returns True if the data was handed to the mqtt client for sending
         try:
             self.__log.logMsg('Sending data to MQTT server: ' + topic, 4)
-            self.mqtt.publish(topic, data)
+            result = self.mqtt.publish(topic, data)
+            if result.rc != self.__paho.MQTT_ERR_SUCCESS:
+                self.__log.logMsg('Error when posting MQTT data to ' + topic + ': ' + self.__paho.error_string(result.rc), 2)
+                return False
         except OSError as e:
             self.__log.logMsg('Requests error when posting MQTT data: ' + str(e), 2)
+            return False
+        return True
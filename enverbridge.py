@@ -1,7 +1,7 @@
 import datetime
 import json
 from slog import slog
-from dateutil import tz
+from enverprofile import enverprofile
 
 #
 # Class to handle communication protocol of Enverbridge
@@ -37,19 +37,35 @@ class enverbridge:
     # Portal acknowledges payload
     COM_ACK_PAYLOAD     = bytearray.fromhex('680012' + '681015')
     COM_ACK_PAYLOAD_END = bytearray.fromhex('0000000000008916')
+    # Payload contains inverter data starting at byte 20, each 32 bytes long
+    PAYLOAD_OFFSET      = 20
+    PAYLOAD_RECORD      = 32
 
-    def __init__(self, mqtt = None, id2device = '', log = None):
+    def __init__(self, mqtt = None, id2device = '', log = None, prof = None, dedup = None):
         if log == None:
             self.__log = slog('Enverbridge class')
         else:
             self.__log = log
+        if prof == None:
+            self.__prof = enverprofile(log = self.__log)
+        else:
+            self.__prof = prof
+        # Index of published readings to drop duplicates, None to publish all readings
+        self.__dedup = dedup
         if mqtt == None:
             self.__log.logMsg('Error in Enverbridge class: No MQTT server instantiated!', 2)
         else:
             self.__mqtt = mqtt
         # Translate between ID of microinverter and MQTT device name
+        self.set_id2device(id2device)
+
+    def set_id2device(self, id2device):
         # Dictionary of inverter id -> MQTT device name
-        self.__id2device = id2device
+        id2device  = dict(id2device)
+        # Set of known inverter ids for lookups when submitting data
+        device_ids = frozenset(id2device)
+        # Swap both by plain assignment, so a reload never leaves a half-built map in use
+        self.__id2device, self.__device_ids = id2device, device_ids
         self.__log.logMsg('Configured microinverter devices: ' + str(id2device), 1)
 
     def get_bridgeID(self, data):
@@ -63,11 +79,7 @@ class enverbridge:
         # return bytearray as hex values with spaces in-between
         if (data is None) or (len(data) == 0):
             return ''
-        data  = data.hex()
-        reply = data[0:2]
-        for i in range(2, len(data), 2):
-            reply += ' ' + data[i:i+2]
-        return reply
+        return data.hex(' ')
 
     def decode_time(self, data):
         # There is a time stamp in COM_START_ACK type 2
@@ -81,6 +93,7 @@ class enverbridge:
         #   ... yy mm dd hh mm ss
         #
         if len(data) >= 19:
+            from dateutil import tz
             # Decoding on hex string, as int() cannot work on bytearray
             data = data.hex()
             # Extract starting at char 30
@@ -103,6 +116,7 @@ class enverbridge:
 
     def encode_time(self, time):
         # encode datetime time to bytearray string to generate COM_ACK_START type 2
+        from dateutil import tz
         # convert time to UTC+8
         time   = time.astimezone(tz.tz.tzoffset('Envertec server time', 60*60*8))
         reply  = '{:0>2x}'.format(time.year - 1900)
@@ -113,6 +127,75 @@ class enverbridge:
         reply += '{:0>2x}'.format(time.second)
         return bytearray.fromhex(reply)
 
+    @staticmethod
+    def payload_type(data):
+        # Return the index of the payload type in COM_PAYLOAD or None
+        start = data[:6]
+        for i in range(0, len(enverbridge.COM_PAYLOAD)):
+            if start == enverbridge.COM_PAYLOAD[i]:
+                return i
+        return None
+
+    @staticmethod
+    def payload_records(data):
+        # Yield the 32 byte inverter data sets of a payload, same as process_data
+        pos1 = enverbridge.PAYLOAD_OFFSET
+        while (pos1 + enverbridge.PAYLOAD_RECORD) < len(data):
+            yield data[pos1:pos1 + enverbridge.PAYLOAD_RECORD]
+            pos1 += enverbridge.PAYLOAD_RECORD
+
+    @staticmethod
+    def decode_values(data):
+        # Decode the 20 bytes of microinverter data into numbers,
+        # see decode_data for the layout. Returns the tuple
+        # (wrid, dc, power, totalkwh, temp, ac, freq)
+        return (data[0:4].hex(),
+                int.from_bytes(data[6:8], 'big') / 512,
+                int.from_bytes(data[8:10], 'big') / 64,
+                int.from_bytes(data[10:14], 'big') / 8192,
+                int.from_bytes(data[14:16], 'big') / 128 - 40,
+                int.from_bytes(data[16:18], 'big') / 64,
+                data[18] + data[19] / 256)
+
+    @staticmethod
+    def encode_values(values):
+        # Encode the tuple (wrid, dc, power, totalkwh, temp, ac, freq)
+        # into 20 bytes of microinverter data, the reverse of decode_values
+        wrid, dc, power, total, temp, ac, freq = values
+        return (bytes.fromhex(wrid) + bytes.fromhex('2202') +
+                int(round(dc * 512)).to_bytes(2, 'big') +
+                int(round(power * 64)).to_bytes(2, 'big') +
+                int(round(total * 8192)).to_bytes(4, 'big') +
+                int(round((temp + 40) * 128)).to_bytes(2, 'big') +
+                int(round(ac * 64)).to_bytes(2, 'big') +
+                int(round(freq * 256)).to_bytes(2, 'big'))
+
+    @staticmethod
+    def encode_frame(start, brid, body):
+        # Build a frame of start sequence, bridge ID and body, padded with zeros
+        # to the length given in the start sequence and ending with checksum and 16.
+        # The checksum algorithm is unknown and not checked by the proxy.
+        length = int.from_bytes(start[1:3], 'big')
+        frame  = bytearray(start) + bytes.fromhex(brid) + body
+        frame += bytes(length - 2 - len(frame))
+        frame += bytes([sum(frame[6:]) & 0xff, 0x16])
+        return frame
+
+    @staticmethod
+    def encode_payload(ptype, brid, values):
+        # Build a payload of type ptype from a list of decoded inverter data,
+        # the reverse of process_data
+        body = bytearray(enverbridge.PAYLOAD_OFFSET - 10)
+        for v in values:
+            body += enverbridge.encode_values(v) + bytes(enverbridge.PAYLOAD_RECORD - 20)
+        return enverbridge.encode_frame(enverbridge.COM_PAYLOAD[ptype], brid, body)
+
+    @staticmethod
+    def payload_capacity(ptype):
+        # Number of inverter data sets fitting into a payload of type ptype
+        length = int.from_bytes(enverbridge.COM_PAYLOAD[ptype][1:3], 'big')
+        return (length - 2 - enverbridge.PAYLOAD_OFFSET) // enverbridge.PAYLOAD_RECORD
+
     def decode_data(self, data):
         # Decode the 20 bytes of microinverter data (40 chars in hex string)
         #                 1    1    2        2    3    3  3 
@@ -125,7 +208,7 @@ class enverbridge:
         if len(data) < 20:
             # Data package is shorter than expected
             self.__log.logMsg('Error in decode_data: Data package is too short (' + str(len(data)) + ')', 2)
-            d_wr_id     = 0
+            d_wr_id     = '00000000'
             d_dez_dc    = 0
             d_dez_power = 0
             d_dez_total = 0
@@ -134,22 +217,13 @@ class enverbridge:
             d_dez_freq  = 0
         else:
             self.__log.logMsg('Decoding microinverter data package: ' + self.hexstr(data[0:20]), 5)
-            # Decoding on string, as int() cannot work on bytearray
-            data        = data.hex()
-            d_wr_id     = data[:8]
-            d_hex_dc    = data[12:12+4]
-            d_hex_power = data[16:16+4]
-            d_hex_total = data[20:20+8]
-            d_hex_temp  = data[28:28+4]
-            d_hex_ac    = data[32:32+4]
-            d_hex_freq  = data[36:36+4]
-            # Calculation
-            d_dez_dc    = '{0:.2f}'.format(int(d_hex_dc, 16) / 512)
-            d_dez_power = '{0:.2f}'.format(int(d_hex_power, 16) / 64)
-            d_dez_total = '{0:.3f}'.format(int(d_hex_total, 16) / 8192)
-            d_dez_temp  = '{0:.2f}'.format(((int(d_hex_temp[0:2], 16) * 256 + int(d_hex_temp[2:4], 16)) / 128) - 40)
-            d_dez_ac    = '{0:.2f}'.format(int(d_hex_ac, 16) / 64)
-            d_dez_freq  = '{0:.2f}'.format(int(d_hex_freq[0:2], 16) + int(d_hex_freq[2:4], 16) / 256)
+            d_wr_id, dc, power, total, temp, ac, freq = self.decode_values(data)
+            d_dez_dc    = '{0:.2f}'.format(dc)
+            d_dez_power = '{0:.2f}'.format(power)
+            d_dez_total = '{0:.3f}'.format(total)
+            d_dez_temp  = '{0:.2f}'.format(temp)
+            d_dez_ac    = '{0:.2f}'.format(ac)
+            d_dez_freq  = '{0:.2f}'.format(freq)
         # Return as dictionary
         return { 'wrid' : d_wr_id, 
                  'dc' : d_dez_dc, 
@@ -163,18 +237,24 @@ class enverbridge:
         # Submit wrdata to MQTT server at url, user, password.
         # Can be https as well. Also: if you use another port then 80 or 443 do not forget to add the port number.
         # user and password.
-        cmd_count = 0
+        cmd_count  = 0
+        device_ids = self.__device_ids
         for wrdict in wrdata:
-            self.__log.logMsg('Submitting data for inverter: ' + str(wrdict['wrid']) + ' to MQTT', 3)
-            values = ['wrid', 'ac', 'dc', 'temp', 'power', 'totalkwh', 'freq']
-            for value in values:
-                if wrdict['wrid'] in self.__id2device:
-                    topic = 'enverbridge/' + wrdict['wrid']
-                    self.__log.logMsg('MQTT topic: ' + topic, 4)
-                    self.__mqtt.send_command(topic, json.dumps(wrdict))
+            if wrdict['wrid'] in device_ids:
+                if self.__dedup != None and self.__dedup.seen(wrdict):
+                    # e.g. resent by the bridge after a reconnect or published by another proxy
+                    self.__log.logMsg('Dropping duplicate data for inverter: ' + str(wrdict['wrid']), 3)
+                    continue
+                self.__log.logMsg('Submitting data for inverter: ' + str(wrdict['wrid']) + ' to MQTT', 3)
+                topic = 'enverbridge/' + wrdict['wrid']
+                self.__log.logMsg('MQTT topic: ' + topic, 4)
+                if self.__mqtt.send_command(topic, json.dumps(wrdict)):
+                    if self.__dedup != None:
+                        # only a published reading drops its resends
+                        self.__dedup.remember(wrdict)
                     cmd_count += 1
-                else:
-                    self.__log.logMsg('No MQTT device known for inverter ID ' + wrdict['wrid'], 2)
+            else:
+                self.__log.logMsg('No MQTT device known for inverter ID ' + wrdict['wrid'], 2)
         self.__log.logMsg('Finished sending to MQTT, ' + str(cmd_count) + ' commands sent', 3)
 
     def process_data(self, data):
@@ -184,6 +264,7 @@ class enverbridge:
         wr_index_max = 20
         # Decoding on chars of hex string, not bytearray
         self.__log.logMsg("Processing data from microinverter", 5)
+        t = self.__prof.start()
         while True:
             # Payload contains multiple sets of inverter data 
             # starting at 20 bytes (40 char) and each 32 bytes (64 char) long
@@ -206,29 +287,31 @@ class enverbridge:
                 break
             inverter         = self.decode_data(data[pos1:pos1+32])
             inverter['brid'] = self.get_bridgeID(data)
-            if int(inverter['wrid']) != 0:
+            if int(inverter['wrid'], 16) != 0:
                 self.__log.logMsg('Decoded data from microinverter with ID ' + str(inverter['wrid']), 3)
                 wr.append(inverter)
             wr_index += 1
+        self.__prof.stop('decode', t)
         if self.__log.get_verbosity() > 3:
             self.__log.logMsg('Finished processing data for ' + str(len(wr)) + ' microinverter: ' + str(wr), 4)
         else:
             self.__log.logMsg('Processed data for ' + str(len(wr)) + ' microinverter', 3)
+        t = self.__prof.start()
         self.submit_data(wr)
+        self.__prof.stop('publish', t)
 
     def handshake(self, data):
         # There are 2 handshake packages, the first one consists of (hex string)
         #   cmd           bridgeID  ?         ?    ?
         #   680020 681027 bbbbbbbb 0001ea800 c1c0 50700000000000000000000000000004816
-        data = bytearray(data)
         # Microinverter session starts with COM_START
         if data[:6] == self.COM_START_EVB:
             # enverbridge expects reply COM_ACK_START type 0
             self.__log.logMsg('Simulating handshake reply type 0', 3)
-            return bytearray.fromhex(self.COM_ACK_START[0].hex() + data[6:].hex())
+            return self.COM_ACK_START[0] + data[6:]
         elif data[:6] == self.COM_START_EVT:
             # microinverter expects reply COM_ACK_START type 2 with timestamp
-            reply = bytearray.fromhex(self.COM_ACK_START[2].hex() + data[6:].hex())
+            reply = self.COM_ACK_START[2] + data[6:]
             if len(reply) >= 19:
                 reply[14:] = self.encode_time(datetime.datetime.now())
             self.__log.logMsg('Simulating handshake reply type 2 with time stamp ' + self.decode_time(reply), 3)
@@ -241,8 +324,8 @@ class enverbridge:
         #   cmd           bridgeID constant
         #   680012 681015 bbbbbbbb 0000000000008916
         # Microinverter payload starts with COM_PAYLOAD
-        if data[:6] == self.COM_PAYLOAD:
-            return bytearray.fromhex(self.COM_ACK_PAYLOAD.hex() + data[6:10].hex() + self.COM_ACK_PAYLOAD_END.hex())
+        if self.payload_type(data) != None:
+            return self.COM_ACK_PAYLOAD + data[6:10] + self.COM_ACK_PAYLOAD_END
         elif data[:6] == self.COM_START_EVB or data[:6] == self.COM_START_EVT:
             self.__log.logMsg('Cannot acknowledge to payload with wrong start sequence ' + self.hexstr(data[:6]), 2)
         else:
@@ -250,13 +333,22 @@ class enverbridge:
 
     def recv_from_device(self, data, simulate):
         reply = ''
-        if data[:6] == self.COM_START_EVB:
+        # Classify the message by its start sequence
+        t      = self.__prof.start()
+        start  = data[:6]
+        is_evb = start == self.COM_START_EVB
+        is_evt = not is_evb and start == self.COM_START_EVT
+        payload_type = None
+        if not is_evb and not is_evt:
+            payload_type = self.payload_type(data)
+        self.__prof.stop('classify', t)
+        if is_evb:
             # EVB device initiates connection
             self.__log.logMsg('Handshake request from EVB device ' + self.get_bridgeID(data) + ' (' + str(len(data)) + ' bytes): ' + self.hexstr(data), 3)
             # There is some data already in the COM_START message
             inverter         = self.decode_data(data[20:])
             inverter['brid'] = self.get_bridgeID(data)
-            if int(inverter['wrid']) != 0:
+            if int(inverter['wrid'], 16) != 0:
                 self.__log.logMsg('Embedded device data: ' + str(inverter), 4)
             if simulate: 
                 # This part is simulating handshake with forward server
@@ -264,7 +356,7 @@ class enverbridge:
                 reply = self.handshake(data)
                 self.__log.logMsg('No forward server, simulating handshake reply: ' + self.hexstr(reply), 4)
             return reply
-        elif data[:6] == self.COM_START_EVT:
+        elif is_evt:
             # EVT device initiates connection
             self.__log.logMsg('Handshake request from EVT device ' + self.get_bridgeID(data) + ' (' + str(len(data)) + ' bytes): ' + self.hexstr(data), 3)
             if simulate: 
@@ -274,11 +366,10 @@ class enverbridge:
                 self.__log.logMsg('No forward server, simulating handshake reply: ' + self.hexstr(reply), 4)
             return reply
         else:
-            for i in range(0, len(self.COM_PAYLOAD)):
-                if data[:6] == self.COM_PAYLOAD[i]:
-                    # payload from device
-                    self.__log.logMsg('Payload type ' + str(i) + ' from device ' + self.get_bridgeID(data) + ' (' + str(len(data)) + ' bytes): ' + self.hexstr(data), 3)
-                    self.process_data(data)
+            if payload_type != None:
+                # payload from device
+                self.__log.logMsg('Payload type ' + str(payload_type) + ' from device ' + self.get_bridgeID(data) + ' (' + str(len(data)) + ' bytes): ' + self.hexstr(data), 3)
+                self.process_data(data)
             if simulate:
                 # simulate acknowledgement
                 reply = self.acknowledge(data)
@@ -0,0 +1,135 @@
+import os
+import ast
+import configparser
+
+def to_id2device(value):
+    # Convert the string representation of a dictionary
+    # inverter id -> MQTT device name into a dictionary
+    id2device = ast.literal_eval(value)
+    if not isinstance(id2device, dict):
+        raise ValueError('expected a dictionary, got ' + type(id2device).__name__)
+    return {str(k): str(v) for k, v in id2device.items()}
+
+def to_bool(value):
+    # Convert yes/no, on/off, true/false or 1/0 into a boolean
+    if value.lower() in configparser.ConfigParser.BOOLEAN_STATES:
+        return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+    raise ValueError('expected yes or no')
+
+def to_positive(value):
+    # Convert into an integer of at least 1
+    number = int(value)
+    if number < 1:
+        raise ValueError('expected at least 1')
+    return number
+
+def to_log_format(value):
+    # Accept the log formats of slog only
+    if value not in ('plain', 'json'):
+        raise ValueError('expected plain or json')
+    return value
+
+def to_listeners(value):
+    # Convert a comma separated list of listen_port:forward_IP:forward_port
+    # into a list of (listen port, (forward IP, forward port))
+    listeners = []
+    for item in value.split(','):
+        item = item.strip()
+        if item == '':
+            continue
+        parts = item.split(':')
+        if len(parts) != 3:
+            raise ValueError('expected listen_port:forward_IP:forward_port, got ' + repr(item))
+        listeners.append((int(parts[0]), (parts[1], int(parts[2]))))
+    return listeners
+
+#
+# Class to read, validate and cache the proxy configuration
+#
+class enverconfig:
+    # Config keys as (key in config file, overriding environment variable, type converter)
+    KEYS = (
+        ('buffer_size',  'BUFFER_SIZE',  int),
+        ('delay',        'DELAY',        float),
+        ('listen_port',  'LISTEN_PORT',  int),
+        ('verbosity',    'VERBOSITY',    int),
+        ('log_type',     'LOG_TYPE',     str),
+        ('log_address',  'LOG_ADDRESS',  str),
+        ('log_port',     'LOG_PORT',     int),
+        ('forward_IP',   'FORWARD_IP',   str),
+        ('forward_port', 'FORWARD_PORT', int),
+        ('mqttuser',     'MQTTUSER',     str),
+        ('mqttpassword', 'MQTTPASSWORD', str),
+        ('mqtthost',     'MQTTHOST',     str),
+        ('mqttport',     'MQTTPORT',     int),
+        ('id2device',    'ID2DEVICE',    to_id2device),
+    )
+    # Optional config keys as (key in config file, overriding environment variable, type converter, default)
+    OPTIONS = (
+        ('listeners',       'LISTENERS',       to_listeners,   ''),
+        ('log_format',      'LOG_FORMAT',      to_log_format,  'plain'),
+        ('log_queue',       'LOG_QUEUE',       int,            '10000'),
+        ('max_sessions',    'MAX_SESSIONS',    int,            '500'),
+        ('selfcheck',       'SELFCHECK',       float,          '3600'),
+        ('memory_budget',   'MEMORY_BUDGET',   int,            '0'),
+        ('dedup_window',    'DEDUP_WINDOW',    float,          '600'),
+        ('dedup_file',      'DEDUP_FILE',      str,            ''),
+        ('dedup_slots',     'DEDUP_SLOTS',     to_positive,    '65536'),
+        ('profile',         'PROFILE',         to_bool,        'no'),
+        ('profile_dir',     'PROFILE_DIR',     str,            '/tmp'),
+        ('profile_seconds', 'PROFILE_SECONDS', float,          '60'),
+    )
+    # static cache is a dictionary of (conf_file, section) to loaded configuration
+    cache = {}
+
+    def __init__(self, conf_file, section = 'enverproxy'):
+        self.conf_file = conf_file
+        self.section   = section
+        # Read and validate all keys at once, so that all errors are reported together
+        errors = []
+        parser = configparser.ConfigParser()
+        if not os.path.isfile(conf_file):
+            raise ValueError('Configuration file ' + conf_file + ' not found')
+        try:
+            parser.read(conf_file)
+        except configparser.Error as e:
+            # e.g. duplicate keys or lines which are no key = value
+            raise ValueError('Config file ' + conf_file + ' cannot be parsed: ' + str(e))
+        if section not in parser:
+            raise ValueError('Section ' + section + ' is missing in config file ' + conf_file)
+        for key, env, convert in self.KEYS:
+            if key not in parser[section]:
+                errors.append('Config variable "' + key + '" is missing in config file ' + conf_file)
+                continue
+            self.convert(parser, key, env, convert, None, errors)
+        for key, env, convert, default in self.OPTIONS:
+            self.convert(parser, key, env, convert, default, errors)
+        if errors:
+            raise ValueError('\n'.join(errors))
+
+    def convert(self, parser, key, env, convert, default, errors):
+        # Set key to its converted value, environment variables override the settings in the config file
+        try:
+            value = os.getenv(env)
+            if value == None:
+                value = parser.get(self.section, key, fallback = default)
+        except configparser.Error as e:
+            # e.g. a % without a valid interpolation
+            errors.append('Config variable "' + key + '" cannot be read: ' + str(e))
+            return
+        try:
+            setattr(self, key, convert(value))
+        except (ValueError, SyntaxError, TypeError) as e:
+            # TypeError e.g. for unhashable keys of id2device
+            errors.append('Config variable "' + key + '" has invalid value ' + repr(value) + ': ' + str(e))
+
+    def __repr__(self):
+        return 'enverconfig(' + self.conf_file + ',' + self.section + ')'
+
+    @classmethod
+    def load(cls, conf_file, section = 'enverproxy', reload = False):
+        # Return the cached configuration, read and validate it only on first use or on reload
+        key = (conf_file, section)
+        if reload or key not in cls.cache:
+            cls.cache[key] = cls(conf_file, section)
+        return cls.cache[key]
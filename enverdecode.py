@@ -0,0 +1,222 @@
+#!/usr/bin/python3
+# Batch decoder for captured Enverbridge traffic, e.g. the traces in trace/
+# or proxy logs written with verbosity 5, into columnar output
+
+import os
+import re
+import sys
+import csv
+import json
+import shutil
+import zipfile
+import tempfile
+import argparse
+import itertools
+import collections
+import multiprocessing
+from enverbridge import enverbridge
+
+# Output columns, in this order
+COLUMNS     = ('time', 'brid', 'type', 'wrid', 'dc', 'power', 'totalkwh', 'temp', 'ac', 'freq')
+STR_COLUMNS = ('time', 'brid', 'wrid')
+# Start of a frame: trace files ("Payload  6803d6 ..."), protocol notes ("982 Bytes  6803d6 ...")
+# and proxy logs ("... as hex: 6803d6..."), lines of log_format json are unpacked first
+FRAME_START = re.compile(r'(?:Payload|Bytes|as hex:)\s+([0-9a-fA-F][0-9a-fA-F ]*)$')
+# A line with nothing but hex digits continues a frame, or starts one if it begins with 68
+HEX_LINE    = re.compile(r'^[0-9a-fA-F][0-9a-fA-F ]*$')
+# Time stamp of trace files and proxy logs, or of syslog files without the year ("Oct 19 18:00:45")
+TIME_STAMP  = re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}|[A-Z][a-z]{2} [ \d]\d \d{2}:\d{2}:\d{2}')
+
+
+def read_frames(paths):
+    # Yield (time, hex string) for every frame in the capture files, line by line
+    for path in paths:
+        with open(path, errors = 'replace') as f:
+            t     = ''
+            frame = None
+            for line in f:
+                line = line.strip()
+                if line.startswith('{'):
+                    line = unpack_json(line)
+                m    = FRAME_START.search(line)
+                if m:
+                    if frame:
+                        yield t, ''.join(frame)
+                    frame = [m.group(1)]
+                    # Proxy logs have the time stamp on the line of the frame
+                    ts = TIME_STAMP.search(line, 0, m.start())
+                    if ts:
+                        t = ts.group(0)
+                elif HEX_LINE.match(line):
+                    if frame != None:
+                        frame.append(line)
+                    elif line.startswith('68'):
+                        frame = [line]
+                else:
+                    if frame:
+                        yield t, ''.join(frame)
+                    frame = None
+                    m = TIME_STAMP.search(line)
+                    if m:
+                        t = m.group(0)
+            if frame:
+                yield t, ''.join(frame)
+
+
+def unpack_json(line):
+    # Return time and message of a proxy log line written with log_format json,
+    # other lines unchanged
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return line
+    if not isinstance(record, dict) or 'message' not in record:
+        return line
+    return str(record.get('time', '')) + ' ' + str(record['message']).strip()
+
+
+def chunked(iterable, size):
+    # Yield lists of at most size items
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def decode_chunk(chunk):
+    # Decode a list of frames into a dictionary of column -> list of values
+    cols = {c: [] for c in COLUMNS}
+    for t, hexstr in chunk:
+        hexstr = hexstr.replace(' ', '')
+        try:
+            data = bytes.fromhex(hexstr[:len(hexstr) & ~1])
+        except ValueError:
+            continue
+        ptype = enverbridge.payload_type(data)
+        if ptype == None:
+            continue
+        brid = data[6:10].hex()
+        for record in enverbridge.payload_records(data):
+            values = enverbridge.decode_values(record)
+            if int(values[0], 16) == 0:
+                continue
+            cols['time'].append(t)
+            cols['brid'].append(brid)
+            cols['type'].append(ptype)
+            for c, v in zip(COLUMNS[3:], values):
+                cols[c].append(v)
+    return cols
+
+
+def decode_all(frames, chunk_size, processes):
+    # Yield decoded chunks in input order, with at most 2 chunks per process in flight
+    chunks = chunked(frames, chunk_size)
+    if processes <= 1:
+        for chunk in chunks:
+            yield decode_chunk(chunk)
+        return
+    with multiprocessing.Pool(processes) as pool:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(decode_chunk, (chunk,)))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+class csv_writer:
+    def __init__(self, fname):
+        self.__file = open(fname, 'w', newline = '')
+        self.__csv  = csv.writer(self.__file)
+        self.__csv.writerow(COLUMNS)
+
+    def write(self, cols):
+        self.__csv.writerows(zip(*(cols[c] for c in COLUMNS)))
+
+    def close(self):
+        self.__file.close()
+
+
+class npz_writer:
+    # .npz cannot be appended, so every column is streamed to a temporary file
+    # with a fixed width dtype and copied into the archive on close
+    DTYPES = {'time': '<U19', 'brid': '<U8', 'wrid': '<U8', 'type': 'i1'}
+
+    def __init__(self, fname):
+        import numpy
+        import numpy.lib.format
+        self.__np    = numpy
+        self.__fname = fname
+        self.__rows  = 0
+        self.__files = {c: tempfile.TemporaryFile(dir = os.path.dirname(os.path.abspath(fname))) for c in COLUMNS}
+
+    def write(self, cols):
+        np = self.__np
+        for c in COLUMNS:
+            np.asarray(cols[c], dtype = self.DTYPES.get(c, 'f8')).tofile(self.__files[c])
+        self.__rows += len(cols['wrid'])
+
+    def close(self):
+        np = self.__np
+        with zipfile.ZipFile(self.__fname, 'w', compression = zipfile.ZIP_DEFLATED) as npz:
+            for c in COLUMNS:
+                f = self.__files[c]
+                f.seek(0)
+                with npz.open(c + '.npy', 'w', force_zip64 = True) as member:
+                    np.lib.format.write_array_header_1_0(member, {'descr': np.dtype(self.DTYPES.get(c, 'f8')).str,
+                                                                  'fortran_order': False, 'shape': (self.__rows,)})
+                    shutil.copyfileobj(f, member)
+                f.close()
+
+
+class parquet_writer:
+    # Every chunk is written as a row group
+    def __init__(self, fname):
+        import pyarrow
+        import pyarrow.parquet
+        self.__pa     = pyarrow
+        self.__schema = pyarrow.schema([(c, pyarrow.string() if c in STR_COLUMNS else pyarrow.int8() if c == 'type' else pyarrow.float64())
+                                        for c in COLUMNS])
+        self.__writer = pyarrow.parquet.ParquetWriter(fname, self.__schema)
+
+    def write(self, cols):
+        if cols['wrid']:
+            self.__writer.write_table(self.__pa.table(cols, schema = self.__schema))
+
+    def close(self):
+        self.__writer.close()
+
+
+WRITERS = {'csv': csv_writer, 'npz': npz_writer, 'parquet': parquet_writer}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Decode captured Enverbridge payloads (EVB201, EVB300, EVT800) into columnar output.')
+    parser.add_argument('files', nargs = '+', help = 'capture files: traces, protocol notes or proxy logs (plain, json or syslog) with verbosity 5')
+    parser.add_argument('-o', '--output', required = True, help = 'output file')
+    parser.add_argument('-f', '--format', choices = sorted(WRITERS), help = 'output format, default from the extension of the output file')
+    parser.add_argument('-c', '--chunk', type = int, default = 10000, help = 'frames per chunk (default: %(default)s)')
+    parser.add_argument('-p', '--processes', type = int, default = multiprocessing.cpu_count(), help = 'decoding processes (default: %(default)s)')
+    args = parser.parse_args(argv)
+    fmt  = args.format or args.output.rsplit('.', 1)[-1]
+    if fmt not in WRITERS:
+        parser.error('unknown output format ' + fmt + ', use --format')
+    try:
+        writer = WRITERS[fmt](args.output)
+    except ImportError as e:
+        parser.error('output format ' + fmt + ' requires ' + str(e.name))
+    rows = 0
+    for cols in decode_all(read_frames(args.files), args.chunk, args.processes):
+        writer.write(cols)
+        rows += len(cols['wrid'])
+    writer.close()
+    print(str(rows) + ' rows written to ' + args.output, file = sys.stderr)
+    if rows == 0:
+        print('Warning: no payloads found, proxy logs must be written with verbosity 5', file = sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import mmap
+import struct
+import hashlib
+import collections
+from slog import slog
+
+#
+# Class to drop readings already published within a time window, optionally shared
+# between proxies on one host through a memory-mapped file
+#
+class enverdedup:
+    # Slot of the shared index: fingerprint and time of publishing
+    SLOT   = struct.Struct('<Qd')
+    # Number of slots searched for a fingerprint in the shared index
+    PROBES = 16
+
+    def __init__(self, window = 600, shared_file = '', slots = 65536, log = None):
+        if log == None:
+            self.__log = slog('Enverdedup class')
+        else:
+            self.__log = log
+        self.__window = window
+        self.__slots  = slots
+        # Local index is a dictionary of fingerprint -> time, oldest first
+        self.__local  = collections.OrderedDict()
+        self.__file   = None
+        self.__map    = None
+        if shared_file:
+            import fcntl
+            self.__fcntl = fcntl
+            size = slots * self.SLOT.size
+            fd = os.open(shared_file, os.O_RDWR | os.O_CREAT, 0o644)
+            self.__file = os.fdopen(fd, 'r+b')
+            fcntl.flock(self.__file, fcntl.LOCK_EX)
+            try:
+                current = os.fstat(fd).st_size
+                if current == 0:
+                    # new file, start with an empty index
+                    self.__file.truncate(size)
+                elif current != size:
+                    # other proxies may have mapped the file, resizing it would crash them
+                    self.__file.close()
+                    raise ValueError(shared_file + ' has ' + str(current // self.SLOT.size) + ' slots, expected ' +
+                                     str(slots) + ': use the same dedup_slots for all proxies or remove the file')
+            finally:
+                if not self.__file.closed:
+                    fcntl.flock(self.__file, fcntl.LOCK_UN)
+            self.__map = mmap.mmap(fd, size)
+            self.__log.logMsg('Readings deduplicated within ' + str(window) + ' seconds, shared through ' + shared_file, 2)
+        else:
+            self.__log.logMsg('Readings deduplicated within ' + str(window) + ' seconds', 2)
+
+    @staticmethod
+    def fingerprint(wrdict):
+        # 64 bit fingerprint of wrid, totalkwh and a hash of the whole reading, never 0
+        content = json.dumps(wrdict, sort_keys = True)
+        digest  = hashlib.blake2b((str(wrdict.get('wrid')) + '|' + str(wrdict.get('totalkwh')) + '|' + content).encode(),
+                                  digest_size = 8).digest()
+        return int.from_bytes(digest, 'little') or 1
+
+    def seen(self, wrdict, now = None):
+        # Return True if the reading was published within the window
+        if now == None:
+            now = time.time()
+        fp = self.fingerprint(wrdict)
+        if self.__map != None:
+            return self.seen_shared(fp, now)
+        return self.seen_local(fp, now)
+
+    def remember(self, wrdict, now = None):
+        # Remember the reading as published now, only call after it was published
+        if now == None:
+            now = time.time()
+        fp = self.fingerprint(wrdict)
+        if self.__map != None:
+            self.remember_shared(fp, now)
+        else:
+            self.remember_local(fp, now)
+
+    def seen_local(self, fp, now):
+        t = self.__local.get(fp)
+        return t != None and t >= now - self.__window
+
+    def remember_local(self, fp, now):
+        local  = self.__local
+        oldest = now - self.__window
+        local.pop(fp, None)
+        # Evict expired readings and keep the index bounded
+        while local and (next(iter(local.values())) < oldest or len(local) >= self.__slots):
+            local.popitem(last = False)
+        local[fp] = now
+
+    def seen_shared(self, fp, now):
+        fcntl  = self.__fcntl
+        slot   = self.SLOT
+        oldest = now - self.__window
+        fcntl.flock(self.__file, fcntl.LOCK_SH)
+        try:
+            for i in range(self.PROBES):
+                sfp, stime = slot.unpack_from(self.__map, ((fp + i) % self.__slots) * slot.size)
+                if sfp == fp and stime >= oldest:
+                    return True
+            return False
+        finally:
+            fcntl.flock(self.__file, fcntl.LOCK_UN)
+
+    def remember_shared(self, fp, now):
+        fcntl  = self.__fcntl
+        slot   = self.SLOT
+        oldest = now - self.__window
+        fcntl.flock(self.__file, fcntl.LOCK_EX)
+        try:
+            free = None
+            for i in range(self.PROBES):
+                offset = ((fp + i) % self.__slots) * slot.size
+                sfp, stime = slot.unpack_from(self.__map, offset)
+                if sfp == fp:
+                    # published again, e.g. by another proxy at the same time
+                    free = offset
+                    break
+                if free == None and (sfp == 0 or stime < oldest):
+                    free = offset
+            if free == None:
+                # all probed slots are in use, replace the first one
+                free = (fp % self.__slots) * slot.size
+            slot.pack_into(self.__map, free, fp, now)
+        finally:
+            fcntl.flock(self.__file, fcntl.LOCK_UN)
@@ -0,0 +1,131 @@
+import os
+import time
+import signal
+from slog import slog
+
+#
+# Class to time the stages of the proxy and to capture cProfile and tracemalloc data on demand
+#
+class enverprofile:
+    # Stages timed in TheServer and enverbridge
+    STAGES = ('recv', 'classify', 'decode', 'publish', 'forward')
+    # Number of lines written to a tracemalloc capture
+    TRACEMALLOC_TOP = 50
+
+    def __init__(self, enabled = False, profile_dir = '/tmp', profile_seconds = 60, log = None):
+        if log == None:
+            self.__log = slog('Enverprofile class')
+        else:
+            self.__log = log
+        # Stage timers are on when configured or while a capture is running
+        self.__timers     = enabled
+        self.enabled      = enabled
+        self.__dir        = profile_dir
+        self.__seconds    = profile_seconds
+        self.__profile    = None
+        self.__tracing    = False
+        self.reset()
+
+    def reset(self):
+        # Dictionary of stage -> [count, total seconds, max seconds]
+        self.__stats = {stage: [0, 0.0, 0.0] for stage in self.STAGES}
+
+    def start(self):
+        # Return the start time of a stage, only read the clock when enabled
+        if self.enabled:
+            return time.perf_counter()
+        return 0.0
+
+    def stop(self, stage, start):
+        # Add the time since start to stage
+        if self.enabled:
+            t = time.perf_counter() - start
+            s = self.__stats[stage]
+            s[0] += 1
+            s[1] += t
+            if t > s[2]:
+                s[2] = t
+
+    def report(self):
+        # Write the stage timings to the log and start over
+        for stage in self.STAGES:
+            count, total, tmax = self.__stats[stage]
+            if count > 0:
+                self.__log.logMsg('Stage ' + stage + ': ' + str(count) + ' calls, ' +
+                                  '{0:.3f}'.format(total / count * 1000) + ' ms mean, ' +
+                                  '{0:.3f}'.format(tmax * 1000) + ' ms max', 2)
+        self.reset()
+
+    def report_timers(self):
+        # Write the timings of configured stage timers, a running capture reports when it ends
+        if self.__timers and self.__profile == None and not self.__tracing:
+            self.report()
+
+    def filename(self, suffix):
+        return os.path.join(self.__dir, 'enverproxy-' + time.strftime('%Y%m%d-%H%M%S') + suffix)
+
+    def sigusr1_handler(self, signum, frame):
+        # Start a cProfile capture, which ends after profile_seconds or on the next SIGUSR1
+        if self.__profile != None:
+            self.stop_capture()
+            return
+        import cProfile
+        self.__log.logMsg('Received SIGUSR1, starting cProfile capture for ' + str(self.__seconds) + ' seconds', 2)
+        self.__profile = cProfile.Profile()
+        self.begin_capture()
+        self.__profile.enable()
+
+    def sigusr2_handler(self, signum, frame):
+        # Start a tracemalloc capture, which ends after profile_seconds or on the next SIGUSR2
+        if self.__tracing:
+            self.stop_capture()
+            return
+        import tracemalloc
+        self.__log.logMsg('Received SIGUSR2, starting tracemalloc capture for ' + str(self.__seconds) + ' seconds', 2)
+        tracemalloc.start()
+        self.__tracing = True
+        self.begin_capture()
+
+    def begin_capture(self):
+        # Turn stage timers on and bound the capture with a timer signal,
+        # timings of configured stage timers are reported before the capture starts
+        if self.__timers:
+            self.report()
+        else:
+            self.reset()
+        self.enabled = True
+        signal.signal(signal.SIGALRM, self.sigalrm_handler)
+        signal.setitimer(signal.ITIMER_REAL, self.__seconds)
+
+    def sigalrm_handler(self, signum, frame):
+        self.stop_capture()
+
+    def stop_capture(self):
+        # Write all running captures to files in profile_dir
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        if self.__profile != None:
+            self.__profile.disable()
+            fname = self.filename('.prof')
+            try:
+                self.__profile.dump_stats(fname)
+            except OSError as e:
+                self.__log.logMsg('Could not write cProfile capture: ' + str(e), 2)
+            else:
+                self.__log.logMsg('cProfile capture written to ' + fname, 2)
+            self.__profile = None
+        if self.__tracing:
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self.__tracing = False
+            fname = self.filename('.tracemalloc.txt')
+            try:
+                with open(fname, 'w') as f:
+                    for stat in snapshot.statistics('lineno')[:self.TRACEMALLOC_TOP]:
+                        f.write(str(stat) + '\n')
+            except OSError as e:
+                self.__log.logMsg('Could not write tracemalloc capture: ' + str(e), 2)
+            else:
+                self.__log.logMsg('tracemalloc capture written to ' + fname, 2)
+        self.report()
+        self.enabled = self.__timers
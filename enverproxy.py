@@ -5,27 +5,28 @@ import socket
 import select
 import time
 import sys
-import os
 import errno
-import configparser
-import ast
+import gc
+import resource
 import syslog
 import signal
 from slog import slog
 from MQTT import MQTT
 from enverbridge import enverbridge
+from enverconfig import enverconfig
+from enverprofile import enverprofile
+from enverdedup import enverdedup
 
-config = configparser.ConfigParser()
-config['internal']              = {}
-config['internal']['conf_file'] = '/etc/enverproxy-mqtt.conf'
-config['internal']['section']   = 'enverproxy'
-config['internal']['version']   = '3.1'
-config['internal']['keys']      = "['buffer_size', 'delay', 'listen_port', 'verbosity', 'log_type', 'log_address', 'log_port', 'forward_IP', 'forward_port', 'mqttuser', 'mqttpassword', 'mqtthost', 'mqttport', 'id2device']"
+conf_file    = '/etc/enverproxy-mqtt.conf'
+conf_section = 'enverproxy'
+version      = '3.1'
 
 #
 # Class to handle receiving server
 #
 class Forward:
+    __slots__ = ('__log', 'forward')
+
     def __init__(self, log = None):
         if log == None:
             self.__log = slog('Forward class')
@@ -38,69 +39,125 @@ class Forward:
             self.forward.connect((host, port))
         except OSError as e:
             self.__log.logMsg('Forward server produced error: ' + str(e), 2)
+            # do not leak the socket of the failed connection
+            self.forward.close()
             return False
         self.__log.logMsg('Connected to Forward server: ' + str(host) + ' on port: ' + str(port), 3)
         # return the socket connection to the forward server
         return self.forward
 
 
+#
+# Class of a proxy session between a client and its forward server
+#
+class Session:
+    __slots__ = ('client', 'forward', 'listener')
+
+    def __init__(self, client, listener):
+        self.client   = client
+        # socket of the forward server, None while forwarding is simulated
+        self.forward  = None
+        # (listen port, forward server) of the listener accepting the client
+        self.listener = listener
+
+    def __repr__(self):
+        return 'Session(' + str(self.client) + ' <-> ' + str(self.forward) + ')'
+
+
 #
 # Class of the proxy server
 #
 class TheServer:
     # static input_list contains list of connections of socket class
     input_list       = []
-    # static channel is a dictionary with socket to socket connections
-    channel          = {}
-    # static simulate_forward is a dictionary flaggin whether a forward is simulated
-    simulate_forward = {}
+    # static sessions is a dictionary of client and forward server sockets -> Session
+    sessions         = {}
+    # static servers is a dictionary of listening socket -> (listen port, forward server)
+    servers          = {}
+    # select cannot handle more than 1024 sockets, each session has up to 2 sockets
+    MAX_SESSIONS     = 500
 
-    def __init__(self, host, port, forward_to, delay = 0.0001, buffer_size = 4096, log = None):
+    def __init__(self, host, port = None, forward_to = None, delay = 0.0001, buffer_size = 4096, log = None, prof = None, listeners = None,
+                 max_sessions = 500, selfcheck_interval = 0, memory_budget = 0):
+        # listeners is a list of (listen port, forward server) served in one loop,
+        # if not set, the proxy listens on port and forwards to forward_to
         if log == None:
             self.__log = slog('TheServer class')
         else:
             self.__log = log
+        if prof == None:
+            self.__prof = enverprofile(log = self.__log)
+        else:
+            self.__prof = prof
+        if listeners == None:
+            listeners = [(port, forward_to)]
         self.__delay           = delay
         self.__buffer_size     = buffer_size
-        self.__forward_to      = forward_to
-        self.__port            = port
         self.__host            = host
         self.__device          = None
-        self.server            = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server.bind((host, port))
-        self.server.listen(200)
+        # Limits of the memory budget: number of sessions, RSS in MB and seconds between self checks
+        if max_sessions <= 0 or max_sessions > self.MAX_SESSIONS:
+            max_sessions = self.MAX_SESSIONS
+        self.__max_sessions    = max_sessions
+        self.__session_count   = 0
+        self.__memory_budget   = memory_budget
+        self.__selfcheck       = selfcheck_interval
+        self.__next_selfcheck  = time.monotonic() + selfcheck_interval
+        # Receive buffer reused for all frames
+        self.__buffer          = bytearray(buffer_size)
+        self.__view            = memoryview(self.__buffer)
+        for port, forward_to in listeners:
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((host, port))
+            server.listen(200)
+            self.servers[server] = (port, forward_to)
+            self.__log.logMsg('Listening on port ' + str(port) + ', forwarding to ' + str(forward_to), 2)
+        # first listening socket
+        self.server            = next(iter(self.servers))
 
     def set_device(self, device):
         # Set the device to handle communications protocol
         self.__device = device
 
+    def log_state(self, prefix):
+        # Write connections and sessions to the log, only built with verbosity 5
+        if self.__log.get_verbosity() >= 5:
+            self.__log.logMsg(prefix + ' connection list: ' + str(self.input_list), 5)
+            self.__log.logMsg(prefix + ' session dictionary: ' + str(self.sessions), 5)
+
     def is_client(self, sock):
         # check whether the connection is a client or a forward server
-        if sock.getsockname()[1] == self.__port:
-            return True
-        else:
-            return False
+        session = self.sessions.get(sock)
+        return session != None and session.client is sock
 
     def is_simforward(self, sock):
         # check whether the proxy peer is a simulated forward server
-        return self.simulate_forward[sock]
+        return self.sessions[sock].forward == None
+
+    def get_peer(self, sock):
+        # return the proxy peer of sock, None if forwarding is simulated
+        session = self.sessions[sock]
+        if session.client is sock:
+            return session.forward
+        return session.client
 
     def connect_forward(self, sock):
         # try to establish a connection with the forward server
         if self.is_client(sock):
-            self.simulate_forward[sock] = True
-            forward = Forward(self.__log).start(self.__forward_to[0], self.__forward_to[1])
+            session    = self.sessions[sock]
+            forward_to = session.listener[1]
+            if len(self.sessions) >= 2 * self.__max_sessions:
+                # A forward socket would exceed the sockets select can handle
+                self.__log.logMsg('connect_forward: Maximum of ' + str(2 * self.__max_sessions) + ' sockets reached, will simulate forwarding of messages.', 3)
+                return False
+            forward    = Forward(self.__log).start(forward_to[0], forward_to[1])
             self.__log.logMsg('connect_forward: Forward.start returned: ' + str(forward), 5)
             if forward:
                 self.input_list.append(forward)
-                self.simulate_forward[sock]    = False
-                self.simulate_forward[forward] = False
-                self.channel[sock]             = forward
-                self.channel[forward]          = sock
-                self.__log.logMsg('connect_forward: New connection list: ' + str(self.input_list), 5)
-                self.__log.logMsg('connect_forward: New channel dictionary: ' + str(self.channel), 5)
-                self.__log.logMsg('connect_forward: New simulated forwarding dictionary: ' + str(self.simulate_forward), 5)
+                session.forward        = forward
+                self.sessions[forward] = session
+                self.log_state('connect_forward: New')
                 return True
             else:
                 self.__log.logMsg('connect_forward: Could not establish connection with forward server, will simulate forwarding of messages.', 3)
@@ -110,23 +167,37 @@ class TheServer:
         return False
 
     def main_loop(self):
-        self.input_list.append(self.server)
+        self.input_list.extend(self.servers)
         while True:
             self.__log.logMsg('Entering main loop', 5)
             time.sleep(self.__delay)
             ss = select.select
             # Wait for incoming connections or data
             # inputready, outputready and exceptready return lists of socket connections
-            inputready, outputready, exceptready = ss(self.input_list, [], [])
+            if self.__selfcheck > 0:
+                inputready, outputready, exceptready = ss(self.input_list, [], [], self.__selfcheck)
+                if time.monotonic() >= self.__next_selfcheck:
+                    self.self_check()
+                    # input_list may have changed, wait again
+                    continue
+            else:
+                inputready, outputready, exceptready = ss(self.input_list, [], [])
             self.__log.logMsg('main_loop: Input received: ' + str(inputready), 4)
             # Process new incoming data
             for sock in inputready:
-                if sock == self.server:
-                    # sock in inputready points to the proxy server itself, e.g.
+                if sock in self.servers:
+                    # sock in inputready points to a listening socket of the proxy server itself, e.g.
                     # <socket.socket fd=4, family=AddressFamily.AF_INET, type=SocketKind.SOCK_STREAM, proto=0, laddr=('0.0.0.0', 10013)>
                     # meaning that the proxy has a new connection request.
-                    self.on_accept()
+                    self.on_accept(sock)
                     break
+                if sock not in self.input_list:
+                    # sock was closed while handling a previous socket of inputready
+                    continue
+                if sock not in self.sessions:
+                    # sock has no session and would be ready forever
+                    self.on_close(sock)
+                    continue
                 # sock points to an existing socket connection, e.g.
                 # <socket.socket fd=6, family=AddressFamily.AF_INET, type=SocketKind.SOCK_STREAM, proto=0, laddr=('172.80.1.2', 10013), raddr=('192.168.123.55', 49216)>
                 # Test if data comes from client and forward server is being simulated
@@ -135,118 +206,120 @@ class TheServer:
                     # try again to connect to forward server
                     self.__log.logMsg('main_loop: Simulating so far, trying to connect to forward server', 3)
                     self.connect_forward(sock)
-                # get the data from the socket connection
+                # get the data from the socket connection into the receive buffer
                 try:
-                    data = sock.recv(self.__buffer_size)
+                    t = self.__prof.start()
+                    size = sock.recv_into(self.__buffer)
+                    self.__prof.stop('recv', t)
                 except OSError as e:
                     self.__log.logMsg('main_loop: Socket error on input ' + str(sock) + ': ' + str(e), 2)
-                    time.sleep(1) 
                     if e.errno in (errno.ENOTCONN, errno.ECONNRESET, errno.EBADF):
                         # Connection was closed abnormally or file descriptor is bad
                         self.on_close(sock)
                 else:
-                    if (data is None) or (len(data)) == 0:
+                    if size == 0:
                         # Client closed the connection
                         self.__log.logMsg('main_loop: No data received, probably peer closed the connection', 2)
                         self.on_close(sock)
                         break
                     else:
-                        self.__log.logMsg('main_loop: ' + str(len(data)) + ' bytes received from ' + str(sock.getpeername()), 4)
-                        self.on_recv(sock, data)
+                        self.__log.logMsg('main_loop: ' + str(size) + ' bytes received from ' + str(sock), 4)
+                        # the view is only valid until the next frame is received
+                        self.on_recv(sock, self.__view[:size])
 
-    def on_accept(self):
+    def on_accept(self, server = None):
         self.__log.logMsg('Entering on_accept', 5)
+        if server == None:
+            server = self.server
         # accept the incoming client's connection request
-        clientsock, clientaddr = self.server.accept()
-        self.__log.logMsg('on_accept: ' + str(clientaddr) + ' has connected', 2)
+        clientsock, clientaddr = server.accept()
+        if self.__session_count >= self.__max_sessions:
+            self.__log.logMsg('on_accept: Maximum of ' + str(self.__max_sessions) + ' sessions reached, closing connection of ' + str(clientaddr), 2)
+            clientsock.close()
+            return
+        self.__log.logMsg('on_accept: ' + str(clientaddr) + ' has connected on port ' + str(self.servers[server][0]), 2)
         self.input_list.append(clientsock)
+        self.sessions[clientsock] = Session(clientsock, self.servers[server])
+        self.__session_count     += 1
         # proxy client connected, establish a connection to the forward server
         if not self.connect_forward(clientsock):
-            self.__log.logMsg('on_accept: New connection list: ' + str(self.input_list), 5)
-            self.__log.logMsg('on_accept: New channel dictionary: ' + str(self.channel), 5)
-            self.__log.logMsg('on_accept: New simulated forwarding dictionary: ' + str(self.simulate_forward), 5)
+            self.log_state('on_accept: New')
         self.__log.logMsg('Leaving on_accept', 5)
 
+    def remove(self, sock):
+        # remove sock from connection list and sessions and close it
+        session = self.sessions.pop(sock, None)
+        if session != None and session.client is sock:
+            self.__session_count -= 1
+        if sock in self.input_list:
+            self.input_list.remove(sock)
+        try:
+            sock.close()
+        except OSError as e:
+            # Connection was most likely already closed
+            self.__log.logMsg('on_close: Socket error with sock: ' + str(sock) + ' - ' + str(e), 2)
+
     def on_close(self, sock):
         # Close the client connection sock
         self.__log.logMsg('Entering on_close with sock: ' + str(sock), 5)
-        self.__log.logMsg('on_close: Connection list: ' + str(self.input_list), 5)
-        self.__log.logMsg('on_close: Channel dictionary: ' + str(self.channel), 5)
-        self.__log.logMsg('on_close: Simulated forwarding dictionary: ' + str(self.simulate_forward), 5)
-        if sock == self.input_list[0]:
-            # First connection cannot be closed: proxy listening on its port
+        self.log_state('on_close:')
+        if sock in self.servers:
+            # Listening sockets cannot be closed: proxy listening on its ports
             self.__log.logMsg('on_close: Server listening port will not be closed', 4)
         else:
-            # if sock is a client, close forward first
-            if self.is_client(sock):
-                if not self.is_simforward(sock):
+            session = self.sessions.get(sock)
+            if session == None:
+                # sock has no session, just make sure it does not stay open
+                self.__log.logMsg('on_close: Closing orphaned socket: ' + str(sock), 2)
+            elif session.client is sock:
+                # if sock is a client, close forward first
+                if session.forward != None:
                     # not simulating forward, so remove forward server
-                    peer = self.channel[sock]
-                    self.__log.logMsg("on_close: Closing forward server's socket: " + str(peer), 3)
-                    del self.channel[peer]
-                    del self.simulate_forward[peer]
-                    if peer in self.input_list:
-                        self.input_list.remove(peer)
-                    # close the connection with peer
-                    try:
-                        peer.close()
-                    except OSError as e:
-                        self.__log.logMsg('on_close: Socket error with forward server: ' + str(peer) + ' - ' + str(e), 2)
+                    self.__log.logMsg("on_close: Closing forward server's socket: " + str(session.forward), 3)
+                    self.remove(session.forward)
+                    session.forward = None
             else:
-                # As sock is a forwarding server, set its client to simulate_forward 
-                self.simulate_forward[self.channel[sock]] = True
-            # remove objects of sock, which is either client or forward server
-            self.__log.logMsg('on_close: Closing sock socket: ' + str(sock), 3)            
-            if sock in self.channel:
-                del self.channel[sock]
-            if sock in self.simulate_forward:
-                del self.simulate_forward[sock]
-            if sock in self.input_list:
-                self.input_list.remove(sock)
-            # close socket sock
-            try:
-                # close the connection with client
-                sock.close()
-            except OSError as e:
-                # Connection was most likely already closed
-                self.__log.logMsg('on_close: Socket error with sock: ' + str(sock) + ' - ' + str(e), 2)
-        self.__log.logMsg('on_close: Remaining connection list: ' + str(self.input_list), 5)
-        self.__log.logMsg('on_close: Remaining channel dictionary: ' + str(self.channel), 5)
-        self.__log.logMsg('on_close: Remaining simulated forwarding dictionary: ' + str(self.simulate_forward), 5)
+                # As sock is a forwarding server, its client continues simulating the forward server
+                session.forward = None
+            # remove sock, which is either client or forward server
+            self.__log.logMsg('on_close: Closing sock socket: ' + str(sock), 3)
+            self.remove(sock)
+        self.log_state('on_close: Remaining')
         self.__log.logMsg('Leaving on_close', 5)
         
     def close_all(self):
         # Close all connections
         self.__log.logMsg('Entering close_all', 5)
-        if len(self.input_list) > 1:
-            # First connection cannot be closed: proxy listening on its port
-            self.__log.logMsg('close_all: Closing all connections: ' + str(self.input_list[1:]), 3)
-            for con in self.input_list[1:]:
+        # Listening sockets cannot be closed: proxy listening on its ports
+        connections = [con for con in self.input_list if con not in self.servers]
+        if len(connections) > 0:
+            self.__log.logMsg('close_all: Closing all connections: ' + str(len(connections)), 3)
+            for con in connections:
                 # test, as connection might have been closed already
                 # by previous call to on_close
                 if con in self.input_list:
-                    self.__log.logMsg('close_all: Remaining connection list: ' + str(self.input_list[1:]),5)
                     self.on_close(con)
         self.__log.logMsg('Leaving close_all', 5)
 
     def on_recv(self, sock, data):
-        # Data is accessible as a bytearray in data
+        # Data is accessible as a memoryview of the receive buffer in data
         self.__log.logMsg('Entering on_recv', 5)
         reply = ''
-        self.__log.logMsg(str(len(data)) + ' bytes of data in on_recv as hex: ' + str(data.hex()), 5) 
+        if self.__log.get_verbosity() >= 5:
+            self.__log.logMsg(str(len(data)) + ' bytes of data in on_recv as hex: ' + str(data.hex()), 5)
         if self.is_client(sock):
             # receving data from a proxy client
-            self.__log.logMsg('on_recv: Client data received by proxy on port: ' + str(self.__port), 4)
+            self.__log.logMsg('on_recv: Client data received by proxy on port: ' + str(self.sessions[sock].listener[0]), 4)
             # Analyse incoming data
             if self.__device == None:
-                self.__log.logMsg('on_recv Warning: No device set to handle communication protocol! Forwarding message to forward server (' + str(len(self.data)) + ' bytes): ' + str(self.data.hex()),2)
+                self.__log.logMsg('on_recv Warning: No device set to handle communication protocol! Forwarding message to forward server (' + str(len(data)) + ' bytes): ' + str(data.hex()),2)
             else:
                 # Call device object to interpret data
                 reply = self.__device.recv_from_device(data = data, simulate = self.is_simforward(sock))
         else:
             # receiving data from forward server
             if self.__device == None:
-                self.__log.logMsg('on_recv Warning: No device set to handle communication protocol! Forwarding message to device (' + str(len(self.data)) + ' bytes): ' + str(self.data.hex()),2)
+                self.__log.logMsg('on_recv Warning: No device set to handle communication protocol! Forwarding message to device (' + str(len(data)) + ' bytes): ' + str(data.hex()),2)
             else:
                 # Call device object to interpret data
                 reply = self.__device.recv_from_forward(data = data)
@@ -255,7 +328,9 @@ class TheServer:
             # directly reply with simulated data to sock
             if not reply is None and reply != '':
                 try:
+                    t = self.__prof.start()
                     sock.send(reply)
+                    self.__prof.stop('forward', t)
                 except OSError as e:
                     self.__log.logMsg('on_recv: Socket error when sending simulated reply to client ' + str(sock) + ': ' + str(e), 2)
                 else:
@@ -264,40 +339,65 @@ class TheServer:
                 self.__log.logMsg('on_recv Warning: Simulated reply is empty, nothing sent to: ' + str(sock), 2)
         else:
             # forward data to proxy peer of sock
-            peer = self.channel[sock]
+            peer = self.get_peer(sock)
             try:
+                t = self.__prof.start()
                 peer.send(data)
+                self.__prof.stop('forward', t)
             except OSError as e:
                 self.__log.logMsg('on_recv: Socket error when sending to proxy peer ' + str(peer) + ': ' + str(e), 2)
-                time.sleep(1) 
-                if e.errno in (errno.ENOTCONN, errno.ECONNRESET, errno.EBADF):
+                if e.errno in (errno.ENOTCONN, errno.ECONNRESET, errno.EBADF, errno.EPIPE):
                     # Connection was closed abnormally or file descriptor is bad
-                    # Proxy peer is dead, so if sock is a client, move to simulating the forward server
+                    # Proxy peer is dead: if it is the forward server, the client moves to
+                    # simulating the forward server, if it is the client, the session ends
                     self.__log.logMsg('on_recv: Closing socket of proxy peer ' + str(peer), 3)
-                    # close the connection with peer
-                    try:
-                        peer.close()
-                    except OSError as e:
-                        self.__log.logMsg('on_recv: Socket error when closing proxy peer ' + str(peer) + ': ' + str(e), 2)
-                    self.simulate_forward[sock] = True
-                    del self.simulate_forward[peer]
-                    self.input_list.remove(peer)
-                    del self.channel[sock]
-                    del self.channel[peer]
-                    self.__log.logMsg('on_recv: Remaining connection list: ' + str(self.input_list), 5)
-                    self.__log.logMsg('on_recv: Remaining channel dictionary: ' + str(self.channel), 5)
-                    self.__log.logMsg('on_recv: Remaining simulated forwarding dictionary: ' + str(self.simulate_forward), 5)
+                    self.on_close(peer)
             else:
                 self.__log.logMsg('on_recv: Data forwarded to: ' + str(peer), 4)
         self.__log.logMsg('Leaving on_recv', 5)
 
+    def self_check(self):
+        # Report memory and sessions, close orphaned sockets and enforce the memory budget
+        self.__next_selfcheck = time.monotonic() + self.__selfcheck
+        orphans = [sock for sock in self.input_list if sock not in self.servers and
+                   (sock not in self.sessions or sock.fileno() == -1)]
+        orphans += [sock for sock in self.sessions if sock not in self.input_list]
+        for sock in orphans:
+            self.on_close(sock)
+        rss = get_rss()
+        self.__log.logMsg('Self check: RSS ' + str(rss) + ' kB, ' +
+                          str(len(gc.get_objects())) + ' objects, ' +
+                          str(len(self.input_list) - len(self.servers)) + ' connections, ' +
+                          str(self.__session_count) + ' sessions, ' +
+                          str(len(orphans)) + ' orphaned sockets closed, ' +
+                          str(self.__log.get_dropped()) + ' log messages dropped', 2)
+        self.__prof.report_timers()
+        if self.__memory_budget > 0 and rss > self.__memory_budget * 1024:
+            self.__log.logMsg('Self check: RSS exceeds memory budget of ' + str(self.__memory_budget) + ' MB, collecting garbage', 2)
+            gc.collect()
+
+
+def get_rss():
+    # Resident set size of the proxy in kB
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() // 1024
+    except OSError:
+        # peak resident set size, where /proc is not available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
 class Signal_handler:
-    def __init__(self, server, log = None):
+    # Config keys which are applied on SIGHUP, all others require a restart
+    RELOAD_KEYS = ('verbosity', 'id2device')
+
+    def __init__(self, server, log = None, device = None, config = None):
         if log == None:
             self.__log = slog('Signal_handler class')
         else:
             self.__log = log
         self.__server = server
+        self.__device = device
+        self.__config = config
             
     def sigterm_handler(self, signal, frame):
         self.__log.logMsg('Received SIGTERM, closing connections', 2)
@@ -305,59 +405,73 @@ class Signal_handler:
         self.__log.logMsg('Stopping server', 1)
         sys.exit(0)
 
+    def sighup_handler(self, signal, frame):
+        # Re-read the config file and apply verbosity and id2device
+        # without touching any open connection
+        self.__log.logMsg('Received SIGHUP, reloading configuration', 2)
+        if self.__config == None:
+            self.__log.logMsg('sighup_handler: No configuration to reload', 2)
+            return
+        try:
+            config = enverconfig.load(self.__config.conf_file, self.__config.section, reload = True)
+        except ValueError as e:
+            # Keep running with the previous configuration
+            self.__log.logMsg('sighup_handler: Configuration not reloaded: ' + str(e), 2)
+            return
+        keys = [option[0] for option in enverconfig.KEYS + enverconfig.OPTIONS]
+        for key in keys:
+            if key not in self.RELOAD_KEYS and getattr(config, key) != getattr(self.__config, key):
+                self.__log.logMsg('sighup_handler: Change of "' + key + '" requires a restart, ignored', 2)
+        if self.__device != None:
+            self.__device.set_id2device(config.id2device)
+        self.__log.set_verbosity(config.verbosity)
+        self.__log.logMsg('Log verbosity: ' + str(self.__log.get_verbosity()), 1)
+
 # MAIN
 if __name__ == '__main__':
     # Initial verbositiy level is always 2
     # Start logging to std.out by default and until config is read 
     log = slog('Envertec Proxy', verbosity = 2, log_type='sys.stdout')
-    # Get configuration data
-    if os.path.isfile(config['internal']['conf_file']):
-       config.read(config['internal']['conf_file'])
-       section = config['internal']['section']
-       if section not in config:
-           log.logMsg('Section ' + section + ' is missing in config file ' + config['internal']['conf_file'], 2)
-           log.logMsg('Stopping server', 1)
-           sys.exit(1)
-       for k in ast.literal_eval(config['internal']['keys']):
-           if k not in config[section]:
-               log.logMsg('Config variable "' + k + '" is missing in config file ' + config['internal']['conf_file'], 2)
-               log.logMsg('Stopping server', 1)
-               sys.exit(1)
-    else:
-        log.logMsg('Configuration file ' + config['internal']['conf_file'] + ' not found', 2)
+    # Get configuration data, validated once at startup
+    try:
+        config = enverconfig.load(conf_file, conf_section)
+    except ValueError as e:
+        log.logMsg(str(e), 2)
         log.logMsg('Stopping server', 1)
         sys.exit(1)
-    # Process configuration data
-    buffer_size = int(os.getenv('BUFFER_SIZE', config.get('enverproxy', 'buffer_size')))
-    delay = float(os.getenv('DELAY', config.get('enverproxy', 'delay')))
-    port = int(os.getenv('LISTEN_PORT', config.get('enverproxy', 'listen_port')))
-    verbosity = int(os.getenv('VERBOSITY', config.get('enverproxy', 'verbosity')))
-    log_type = os.getenv('LOG_TYPE', config.get('enverproxy', 'log_type'))
-    log_address = os.getenv('LOG_ADDRESS', config.get('enverproxy', 'log_address'))
-    log_port = int(os.getenv('LOG_PORT', config.get('enverproxy', 'log_port')))
-    # Forward server configuration
-    forward_IP = os.getenv('FORWARD_IP', config.get('enverproxy', 'forward_IP'))
-    forward_port = int(os.getenv('FORWARD_PORT', config.get('enverproxy', 'forward_port')))
-    forward_to  = (forward_IP, forward_port)
-    # MQTT configuration
-    mqttuser = os.getenv('MQTTUSER', config.get('enverproxy', 'mqttuser'))
-    mqttpassword = os.getenv('MQTTPASSWORD', config.get('enverproxy', 'mqttpassword'))
-    mqtthost = os.getenv('MQTTHOST', config.get('enverproxy', 'mqtthost'))
-    mqttport = int(os.getenv('MQTTPORT', config.get('enverproxy', 'mqttport')))
-    id2device = ast.literal_eval(os.getenv('ID2DEVICE', config.get('enverproxy', 'ID2device')))
+    # Listen on all configured ports, or on listen_port forwarding to forward_IP:forward_port
+    listeners   = config.listeners or [(config.listen_port, (config.forward_IP, config.forward_port))]
     # Instantiate the logging object
-    log         = slog('Envertec Proxy', verbosity, log_type, log_address, log_port)
-    log.logMsg('Starting server (v' + config['internal']['version'] + ')', 1)
-    log.logMsg('Log verbosity: ' + str(verbosity), 1)
+    log         = slog('Envertec Proxy', config.verbosity, config.log_type, config.log_address, config.log_port,
+                       log_format = config.log_format, queue_size = config.log_queue)
+    log.logMsg('Starting server (v' + version + ')', 1)
+    log.logMsg('Log verbosity: ' + str(config.verbosity), 1)
+    # Instantiate the stage timers and profiling captures
+    prof        = enverprofile(enabled = config.profile, profile_dir = config.profile_dir, profile_seconds = config.profile_seconds, log = log)
     # Instantiate the proxy server
-    server      = TheServer(host = '', port = port, forward_to = forward_to, delay = delay, buffer_size = buffer_size, log = log)
+    server      = TheServer(host = '', listeners = listeners, delay = config.delay, buffer_size = config.buffer_size, log = log, prof = prof,
+                            max_sessions = config.max_sessions, selfcheck_interval = config.selfcheck, memory_budget = config.memory_budget)
     # Instantiate the connection to MQTT and the Enverbridge protocol handling
-    mqtt        = MQTT(host = mqtthost, user = mqttuser, password = mqttpassword, port = mqttport, log = log)
+    mqtt        = MQTT(host = config.mqtthost, user = config.mqttuser, password = config.mqttpassword, port = config.mqttport, log = log)
     mqtt.connect_mqtt()
-    device      = enverbridge(mqtt = mqtt, id2device = id2device, log = log)
+    # Index of published readings to drop duplicates
+    dedup       = None
+    if config.dedup_window > 0:
+        try:
+            dedup   = enverdedup(window = config.dedup_window, shared_file = config.dedup_file, slots = config.dedup_slots, log = log)
+        except (OSError, ValueError) as e:
+            log.logMsg('Cannot open deduplication file ' + config.dedup_file + ': ' + str(e), 2)
+            log.logMsg('Stopping server', 1)
+            sys.exit(1)
+    device      = enverbridge(mqtt = mqtt, id2device = config.id2device, log = log, prof = prof, dedup = dedup)
     server.set_device(device)
-    # Catch SIGTERM signals    
-    signal.signal(signal.SIGTERM, Signal_handler(server, log).sigterm_handler)
+    # Catch SIGTERM signals and reload configuration on SIGHUP
+    handler     = Signal_handler(server, log, device, config)
+    signal.signal(signal.SIGTERM, handler.sigterm_handler)
+    signal.signal(signal.SIGHUP, handler.sighup_handler)
+    # Capture cProfile data on SIGUSR1 and tracemalloc data on SIGUSR2
+    signal.signal(signal.SIGUSR1, prof.sigusr1_handler)
+    signal.signal(signal.SIGUSR2, prof.sigusr2_handler)
     # Start proxy server
     try:
         server.main_loop()
@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+# Simulator of a fleet of Enverbridges for load and soak tests of the proxy
+
+import os
+import sys
+import time
+import random
+import statistics
+import struct
+import socket
+import asyncio
+import argparse
+from enverbridge import enverbridge
+
+# Payload type index in enverbridge.COM_PAYLOAD and start sequence of the handshake
+BRIDGE_TYPES = {
+    'evb201' : (0, enverbridge.COM_START_EVB),
+    'evb300' : (1, enverbridge.COM_START_EVB),
+    'evt800' : (2, enverbridge.COM_START_EVT),
+}
+
+# Scenarios as overrides of the command line defaults
+SCENARIOS = {
+    'steady' : {'churn': 0.0,  'abort': 0.0},
+    'churn'  : {'churn': 0.2,  'abort': 0.0},
+    'abort'  : {'churn': 0.0,  'abort': 0.2},
+    'soak'   : {'churn': 0.05, 'abort': 0.05, 'duration': 3600.0},
+}
+
+
+#
+# Class of a virtual bridge with its inverters
+#
+class bridge:
+    def __init__(self, btype, inverters, rnd):
+        self.btype     = btype
+        self.ptype, self.start = BRIDGE_TYPES[btype]
+        # IDs of real devices consist of decimal digits only
+        self.brid      = '{:08d}'.format(rnd.randrange(10**8))
+        self.rnd       = rnd
+        # Decoded inverter data (wrid, dc, power, totalkwh, temp, ac, freq)
+        self.inverters = [['{:08d}'.format(rnd.randrange(1, 10**8)), 0.0, 0.0, rnd.uniform(0, 2000), 0.0, 0.0, 0.0]
+                          for i in range(min(inverters, enverbridge.payload_capacity(self.ptype)))]
+
+    def handshake(self):
+        if self.start == enverbridge.COM_START_EVB:
+            # EVB handshake contains the data of the first inverter
+            body = bytes.fromhex('00000000020000100223') + enverbridge.encode_values(self.inverters[0])
+        else:
+            body = b''
+        return enverbridge.encode_frame(self.start, self.brid, body)
+
+    def payload(self, interval):
+        # Advance all inverters by interval seconds and return the payload
+        rnd = self.rnd
+        for inv in self.inverters:
+            inv[2]  = rnd.uniform(0, 300)
+            inv[1]  = rnd.uniform(28, 40)
+            inv[3] += inv[2] * interval / 3600000
+            inv[4]  = rnd.uniform(10, 60)
+            inv[5]  = rnd.uniform(220, 240)
+            inv[6]  = rnd.uniform(49.9, 50.1)
+        return enverbridge.encode_payload(self.ptype, self.brid, [tuple(inv) for inv in self.inverters])
+
+
+#
+# Class of the simulated fleet and its statistics
+#
+class fleet:
+    def __init__(self, args):
+        self.args  = args
+        self.stats = dict.fromkeys(('connects', 'handshakes', 'payloads', 'replies', 'timeouts', 'closes', 'aborts', 'errors'), 0)
+
+    async def read_reply(self, reader):
+        try:
+            data = await asyncio.wait_for(reader.read(4096), self.args.timeout)
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            return True
+        if not data:
+            # proxy closed the connection
+            return False
+        self.stats['replies'] += 1
+        return True
+
+    async def run_bridge(self, b, deadline):
+        args = self.args
+        rnd  = b.rnd
+        # Spread connects of the fleet over one interval
+        await asyncio.sleep(rnd.uniform(0, args.interval))
+        while time.monotonic() < deadline:
+            try:
+                reader, writer = await asyncio.open_connection(args.host, args.port)
+            except OSError:
+                self.stats['errors'] += 1
+                await asyncio.sleep(args.interval)
+                continue
+            self.stats['connects'] += 1
+            abort = False
+            alive = False
+            try:
+                writer.write(b.handshake())
+                self.stats['handshakes'] += 1
+                alive = await self.read_reply(reader)
+                while alive and time.monotonic() < deadline:
+                    await asyncio.sleep(args.interval * rnd.uniform(0.9, 1.1))
+                    writer.write(b.payload(args.interval))
+                    await writer.drain()
+                    self.stats['payloads'] += 1
+                    alive = await self.read_reply(reader)
+                    if rnd.random() < args.abort:
+                        abort = True
+                        break
+                    if rnd.random() < args.churn:
+                        break
+            except OSError:
+                self.stats['errors'] += 1
+            if abort:
+                # Abrupt disconnect, the proxy receives a RST
+                sock = writer.get_extra_info('socket')
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+                writer.transport.abort()
+                self.stats['aborts'] += 1
+            else:
+                writer.close()
+                self.stats['closes'] += 1
+            if not alive:
+                # proxy closed the connection, e.g. at its maximum of sessions, retry later
+                await asyncio.sleep(args.interval)
+
+    async def run(self):
+        args     = self.args
+        rnd      = random.Random(args.seed)
+        types    = args.types.split(',')
+        deadline = time.monotonic() + args.duration
+        bridges  = [bridge(types[i % len(types)], args.inverters, random.Random(rnd.getrandbits(64)))
+                    for i in range(args.bridges)]
+        monitor  = proxy_monitor(args.pid) if args.pid else None
+        if monitor:
+            # Baseline of the idle proxy
+            print(time.strftime('%H:%M:%S') + ' baseline ' + monitor.sample(), flush = True)
+        tasks    = [asyncio.ensure_future(self.run_bridge(b, deadline)) for b in bridges]
+        while not all(t.done() for t in tasks):
+            await asyncio.sleep(args.sample)
+            line = ' '.join(k + '=' + str(v) for k, v in self.stats.items())
+            if monitor:
+                line += ' ' + monitor.sample()
+            print(time.strftime('%H:%M:%S') + ' ' + line, flush = True)
+        for t in tasks:
+            t.result()
+        if monitor:
+            # Give the proxy time to close the connections of the fleet
+            await asyncio.sleep(args.sample)
+            print(time.strftime('%H:%M:%S') + ' after run ' + monitor.sample(), flush = True)
+            return monitor.check(args.warmup, deadline, args.rss_tolerance, args.fd_tolerance)
+        return True
+
+
+#
+# Class sampling memory and open file descriptors of the proxy process
+#
+class proxy_monitor:
+    def __init__(self, pid):
+        self.pid     = pid
+        self.samples = []
+        self.alive   = True
+
+    def sample(self):
+        rss = 0
+        try:
+            with open('/proc/' + str(self.pid) + '/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss = int(line.split()[1])
+            fds = len(os.listdir('/proc/' + str(self.pid) + '/fd'))
+        except OSError:
+            self.alive = False
+            return 'proxy not running'
+        self.samples.append((time.monotonic(), rss, fds))
+        return 'rss=' + str(rss) + 'kB fds=' + str(fds)
+
+    def check(self, warmup, deadline, rss_tolerance, fd_tolerance):
+        # Under load between warmup and deadline, RSS must stay flat within tolerance:
+        # the median of the last quarter of the samples is compared with the median of the
+        # first quarter, so single samples during churn do not count.
+        # File descriptors of the idle proxy after the run are compared with the baseline.
+        if not self.alive:
+            print('Soak check failed: proxy process ' + str(self.pid) + ' stopped', file = sys.stderr)
+            return False
+        start   = self.samples[0][0] + warmup
+        samples = [s for s in self.samples if start <= s[0] <= deadline]
+        if len(samples) < 2:
+            print('Soak check: not enough samples after warmup', file = sys.stderr)
+            return False
+        window     = max(len(samples) // 4, 1)
+        rss0       = statistics.median(s[1] for s in samples[:window])
+        rss1       = statistics.median(s[1] for s in samples[-window:])
+        fds0, fds1 = self.samples[0][2], self.samples[-1][2]
+        ok = True
+        if rss1 > rss0 * (1 + rss_tolerance):
+            print('Soak check failed: RSS grew from ' + str(rss0) + ' kB to ' + str(rss1) + ' kB', file = sys.stderr)
+            ok = False
+        if fds1 > fds0 + fd_tolerance:
+            print('Soak check failed: file descriptors of the idle proxy grew from ' + str(fds0) + ' to ' + str(fds1), file = sys.stderr)
+            ok = False
+        if ok:
+            print('Soak check passed: RSS ' + str(rss0) + ' -> ' + str(rss1) + ' kB, file descriptors ' + str(fds0) + ' -> ' + str(fds1), file = sys.stderr)
+        return ok
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Simulate a fleet of Enverbridges connecting to the proxy.')
+    parser.add_argument('--host', default = 'localhost', help = 'proxy host (default: %(default)s)')
+    parser.add_argument('--port', type = int, default = 1898, help = 'proxy port (default: %(default)s)')
+    parser.add_argument('--scenario', choices = sorted(SCENARIOS), help = 'preset of churn, abort and duration')
+    parser.add_argument('--bridges', type = int, default = 100, help = 'number of virtual bridges (default: %(default)s)')
+    parser.add_argument('--inverters', type = int, default = 2, help = 'inverters per bridge, limited by the payload type (default: %(default)s)')
+    parser.add_argument('--types', default = 'evb201,evb300,evt800', help = 'comma separated bridge types: ' + ', '.join(BRIDGE_TYPES) + ' (default: %(default)s)')
+    parser.add_argument('--interval', type = float, default = 60.0, help = 'seconds between payloads of a bridge (default: %(default)s)')
+    parser.add_argument('--duration', type = float, default = 300.0, help = 'seconds to run (default: %(default)s)')
+    parser.add_argument('--churn', type = float, default = 0.0, help = 'probability to reconnect after a payload (default: %(default)s)')
+    parser.add_argument('--abort', type = float, default = 0.0, help = 'probability to reset the connection after a payload (default: %(default)s)')
+    parser.add_argument('--timeout', type = float, default = 5.0, help = 'seconds to wait for a reply (default: %(default)s)')
+    parser.add_argument('--seed', type = int, default = 0, help = 'random seed (default: %(default)s)')
+    parser.add_argument('--sample', type = float, default = 10.0, help = 'seconds between statistics (default: %(default)s)')
+    parser.add_argument('--pid', type = int, help = 'process id of the proxy, checks that RSS and file descriptors stay flat')
+    parser.add_argument('--warmup', type = float, default = 60.0, help = 'seconds before the soak check starts (default: %(default)s)')
+    parser.add_argument('--rss-tolerance', type = float, default = 0.1, help = 'allowed relative RSS growth after warmup (default: %(default)s)')
+    parser.add_argument('--fd-tolerance', type = int, default = 0, help = 'allowed growth of file descriptors of the idle proxy after the run (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if args.scenario:
+        parser.set_defaults(**SCENARIOS[args.scenario])
+        args = parser.parse_args(argv)
+    for t in args.types.split(','):
+        if t not in BRIDGE_TYPES:
+            parser.error('unknown bridge type ' + t)
+    try:
+        # Thousands of bridges need as many file descriptors
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+    ok = asyncio.run(fleet(args).run())
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
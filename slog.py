@@ -1,36 +1,115 @@
 import sys
+import json
+import queue
+import atexit
 import logging
 import logging.handlers
 
+
+class json_formatter(logging.Formatter):
+    # Structured log format with one JSON object per line
+    def format(self, record):
+        return json.dumps({'time'    : self.formatTime(record),
+                           'name'    : record.name,
+                           'level'   : record.levelname,
+                           'message' : record.getMessage()})
+
+
+class batch_stream_handler(logging.StreamHandler):
+    # Stream handler leaving the flush to the queue listener after each batch
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+class bounded_queue_handler(logging.handlers.QueueHandler):
+    # Queue handler dropping and counting messages instead of blocking when the queue is full.
+    # Uses a SimpleQueue, as its put is safe to be called from signal handlers.
+    def __init__(self, maxsize):
+        super().__init__(queue.SimpleQueue())
+        self.maxsize = maxsize
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1
+        else:
+            self.queue.put(record)
+
+
+class batch_queue_listener(logging.handlers.QueueListener):
+    # Queue listener handling all waiting messages before flushing its handler once
+    def __init__(self, qhandler, handler, batch_size):
+        super().__init__(qhandler.queue, handler)
+        self.qhandler   = qhandler
+        self.batch_size = batch_size
+        self.reported   = 0
+
+    def enqueue_sentinel(self):
+        # Never drop the sentinel, the listener would not stop
+        self.queue.put(self._sentinel)
+
+    def _monitor(self):
+        q    = self.queue
+        stop = False
+        while not stop:
+            batch = [q.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            for record in batch:
+                if record is self._sentinel:
+                    stop = True
+                else:
+                    self.handle(record)
+            dropped = self.qhandler.dropped
+            if dropped != self.reported:
+                self.handle(logging.makeLogRecord({'name'      : self.qhandler.name or 'slog',
+                                                   'levelno'   : logging.WARNING,
+                                                   'levelname' : 'WARNING',
+                                                   'msg'       : str(dropped - self.reported) + ' log messages dropped, log queue is full'}))
+                self.reported = dropped
+            for handler in self.handlers:
+                handler.flush()
+
+
 class slog:
-    
+
     # Verbosity levels (1-5)
     #   1 = only start/stop
     #   2 = + status and errors
     #   3 = + flow control
-    #   4 = + data 
+    #   4 = + data
     #   5 = anything
-    
-    def __init__(self, ident='', verbosity = 3, log_type='syslog', log_address='/dev/log', log_port=514, cat = logging.INFO):
+
+    # static listeners is a dictionary of logger ident -> running queue listener
+    listeners = {}
+
+    def __init__(self, ident='', verbosity = 3, log_type='syslog', log_address='/dev/log', log_port=514, cat = logging.INFO,
+                 log_format = 'plain', queue_size = 10000, batch_size = 100):
         self.__ident    = ident
         self.__cat      = cat
         self.set_verbosity(verbosity)
         self.__type     = log_type
         self.__address  = log_address
         self.__port     = log_port
-        
+
         if log_type == 'sys.stdout':
-            ch = logging.StreamHandler(sys.stdout)
+            ch = batch_stream_handler(sys.stdout)
             formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
             ch.setFormatter(formatter)
         elif log_type == 'sys.stderr':
-            ch = logging.StreamHandler(sys.stderr)
+            ch = batch_stream_handler(sys.stderr)
             formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
             ch.setFormatter(formatter)
         else:
             # default is to log to syslog
             log_type='syslog'
-            
+
         if log_type == 'syslog':
             if log_address == '/dev/log':
                 ch = logging.handlers.SysLogHandler(address=log_address, facility='daemon')
@@ -38,17 +117,30 @@ class slog:
                 ch = logging.handlers.SysLogHandler(address=(log_address, log_port), facility='daemon')
             formatter = logging.Formatter('%(name)s: %(message)s')
             ch.setFormatter(formatter)
-           
+
+        if log_format == 'json':
+            ch.setFormatter(json_formatter())
+
+        # Messages are written by a listener thread, so slow log targets never block the caller
+        self.__queue    = bounded_queue_handler(queue_size)
+        self.__queue.set_name(self.__ident)
+        listener        = batch_queue_listener(self.__queue, ch, batch_size)
+
         self.__logger = logging.getLogger(self.__ident)
-        self.__logger.setLevel(self.__cat)   
+        self.__logger.setLevel(self.__cat)
         if self.__logger.handlers:
             # remove previous handler
             self.__logger.handlers.pop()
-        self.__logger.addHandler(ch)
-        
+        if self.__ident in self.listeners:
+            # stop listener of previous handler after it wrote all queued messages
+            self.listeners.pop(self.__ident).stop()
+        self.__logger.addHandler(self.__queue)
+        self.listeners[self.__ident] = listener
+        listener.start()
+
     def __repr__(self):
         return 'log(' + str(self.__ident) + ',' + self.__verbosity + ',' + self.__type + ',' + self.__address + ',' + self.__port + ')'
-    
+
     def logMsg (self, msg, vlevel = 3, cat = None):
         if cat == None:
             cat = self.__cat
@@ -58,7 +150,7 @@ class slog:
                 self.__logger.log(cat, msg)
             except:
                 print('Error writing to log for message at level ' + str(cat) + ': ' + msg, file=sys.stderr)
-            
+
     def set_verbosity(self, verbosity):
         if verbosity < 1:
             verbosity = 1
@@ -68,3 +160,15 @@ class slog:
 
     def get_verbosity(self):
         return self.__verbosity
+
+    def get_dropped(self):
+        # Number of messages dropped because the log queue was full
+        return self.__queue.dropped
+
+    @classmethod
+    def close_all(cls):
+        # Write all queued messages and stop the listener threads
+        while cls.listeners:
+            cls.listeners.popitem()[1].stop()
+
+atexit.register(slog.close_all)
@@ -0,0 +1,30 @@
+#!/usr/bin/python3
+# Test that encode_values is the inverse of decode_values within the
+# resolution of every field, e.g. for the values sent by enversim.py
+
+import random
+from enverbridge import enverbridge
+
+# Resolution of (dc, power, totalkwh, temp, ac, freq) in the inverter data
+RESOLUTION = (1 / 512, 1 / 64, 1 / 8192, 1 / 128, 1 / 64, 1 / 256)
+
+def check_round_trip(values):
+    decoded = enverbridge.decode_values(enverbridge.encode_values(values))
+    assert decoded[0] == values[0], (values, decoded)
+    for v, d, r in zip(values[1:], decoded[1:], RESOLUTION):
+        assert abs(v - d) <= r / 2, (values, decoded)
+
+def test_round_trip():
+    rnd = random.Random(0)
+    for i in range(10000):
+        check_round_trip(('{:08d}'.format(rnd.randrange(1, 10**8)), rnd.uniform(28, 40), rnd.uniform(0, 300),
+                          rnd.uniform(0, 2000), rnd.uniform(10, 60), rnd.uniform(220, 240), rnd.uniform(49.9, 50.1)))
+
+def test_fraction_rounding_up():
+    # fractions rounding up to the next integer, e.g. 49.999 Hz
+    check_round_trip(('00123456', 32.999, 99.999, 1.99999, 20.999, 229.999, 49.999))
+
+if __name__ == '__main__':
+    test_round_trip()
+    test_fraction_rounding_up()
+    print('OK')
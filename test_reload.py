@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+# Test that a SIGHUP with a broken config file keeps the previous
+# configuration and all open connections of the proxy
+
+import os
+import signal
+import socket
+import tempfile
+from slog import slog
+from enverconfig import enverconfig
+from enverproxy import TheServer, Signal_handler
+
+port = 10113
+
+def test_sighup_with_broken_config():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'enverproxy-mqtt.conf')) as f:
+        conf = f.read()
+    fd, conf_file = tempfile.mkstemp(suffix = '.conf')
+    with os.fdopen(fd, 'w') as f:
+        f.write(conf)
+    try:
+        config  = enverconfig.load(conf_file)
+        log     = slog('test_reload', 2, 'sys.stdout')
+        server  = TheServer(host = '127.0.0.1', port = port, forward_to = ('127.0.0.1', 1), log = log)
+        handler = Signal_handler(server, log, None, config)
+        signal.signal(signal.SIGHUP, handler.sighup_handler)
+        # Bridge connected to the proxy
+        client  = socket.create_connection(('127.0.0.1', port))
+        server.on_accept(server.server)
+        # Duplicate key, the config file cannot be parsed
+        with open(conf_file, 'a') as f:
+            f.write('\nverbosity = 1\n')
+        os.kill(os.getpid(), signal.SIGHUP)
+        assert enverconfig.load(conf_file) is config
+        assert log.get_verbosity() == 2
+        # Connection of the bridge is still open on both ends
+        assert len(server.sessions) == 1
+        assert all(sock.fileno() != -1 for sock in server.sessions)
+        client.settimeout(0.5)
+        try:
+            data = client.recv(10)
+        except socket.timeout:
+            data = None
+        assert data == None, 'proxy closed the connection'
+        client.close()
+        server.close_all()
+    finally:
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        os.remove(conf_file)
+
+if __name__ == '__main__':
+    test_sighup_with_broken_config()
+    print('OK')